@@ -7,10 +7,10 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from visualization.data_loader import load_usage_data
+from visualization.data_loader import load_raw_usage, apply_categories, aggregate_usage, load_weekly_aggregates
 from visualization.visualizer import Visualizer
 from main import ingest_files
-from database import get_uncategorized_apps, update_app_category, get_all_categories
+from database import get_category_state, update_app_category
 
 # --- Config ---
 st.set_page_config(
@@ -19,21 +19,120 @@ st.set_page_config(
     layout="wide"
 )
 
+# Category lookups are shared across sidebar reruns; cleared on every save
+@st.cache_data(ttl=60)
+def fetch_category_state():
+    """Returns (uncategorized_apps, all_categories)."""
+    return get_category_state()
+
+# --- Load Data ---
+@st.cache_data
+def get_raw_data():
+    return load_raw_usage()
+
+@st.cache_data
+def get_data():
+    df = get_raw_data()
+    if df.empty:
+        return df
+    _, categories = fetch_category_state()
+    return apply_categories(df, categories)
+
+@st.cache_data
+def get_usage_cube():
+    """Per (year, device, app) totals and per (year, device) date spans."""
+    return aggregate_usage(get_data())
+
+@st.cache_data
+def compute_kpis(year, device):
+    """
+    Returns (total_hours, daily_avg_hours, top_app) for the given filters.
+    Computed from the pre-aggregated cube, so the cost depends on the number
+    of apps and devices rather than on the number of usage rows.
+    """
+    agg, span = get_usage_cube()
+    agg = agg[agg['year'] == year]
+    span = span[span['year'] == year]
+    if device != "All":
+        agg = agg[agg['device_name'] == device]
+        span = span[span['device_name'] == device]
+
+    if agg.empty:
+        return 0, 0, "N/A"
+
+    total_hours = agg['duration_seconds'].sum() / 3600
+    days_span = (span['max'].max() - span['min'].min()).days + 1
+    daily_avg_hours = total_hours / max(days_span, 1)
+    top_app = agg.groupby('app_name', observed=True)['duration_seconds'].sum().idxmax()
+    return total_hours, daily_avg_hours, top_app
+
+@st.cache_data
+def get_weekly_aggregates(year, device, breakdown):
+    """Weekly totals aggregated by SQLite for the given filters."""
+    return load_weekly_aggregates(year, device, breakdown)
+
+@st.cache_resource
+def get_visualizer():
+    """
+    Visualizer over the cached usage data, shared by all reruns and sessions.
+    A cache resource is not copied on access, so reruns neither rebuild it nor
+    deserialize the DataFrame again. Charts only read from it.
+    """
+    return Visualizer(get_data())
+
+# Charts: built once per filter combination and shared like the Visualizer.
+# st.plotly_chart serializes a copy of the figure and never modifies it.
+
+@st.cache_resource
+def get_hourly_chart(year, device, breakdown):
+    return get_visualizer().plot_hourly_activity(year=year, device=device, breakdown=breakdown)
+
+@st.cache_resource
+def get_weekly_chart(year, device, breakdown):
+    return get_visualizer().plot_weekly_activity(
+        year=year, device=device, breakdown=breakdown,
+        aggregated=get_weekly_aggregates(year, device, breakdown)
+    )
+
+@st.cache_resource
+def get_calendar_chart(year, device):
+    return get_visualizer().plot_daily_calendar(year=year, device=device)
+
+@st.cache_resource
+def get_trend_chart(year, device):
+    return get_visualizer().plot_usage_trend(year=year, device=device, window=30)
+
+def clear_category_caches():
+    """
+    Invalidates everything derived from the category mapping.
+    The raw usage rows are unaffected by a category change and stay cached.
+    """
+    fetch_category_state.clear()
+    get_data.clear()
+    get_usage_cube.clear()
+    compute_kpis.clear()
+    get_weekly_aggregates.clear()
+    get_visualizer.clear()
+    get_hourly_chart.clear()
+    get_weekly_chart.clear()
+    get_calendar_chart.clear()
+    get_trend_chart.clear()
+
+def clear_data_caches():
+    """Invalidates all cached data after an ingestion."""
+    get_raw_data.clear()
+    clear_category_caches()
+
 # --- Auto Ingestion on Startup ---
 if "data_ingested" not in st.session_state:
     with st.spinner("Checking and importing new data..."):
         try:
             ingest_files()
-            st.cache_data.clear() # Clear cache to ensure fresh data load
+            clear_data_caches()
         except Exception as e:
             st.error(f"Error during auto-ingestion: {e}")
     st.session_state["data_ingested"] = True
 
-# --- Load Data ---
-@st.cache_data
-def get_data():
-    return load_usage_data()
-
 # --- Sidebar ---
 st.sidebar.title("Screen Time Analyzer")
 
@@ -41,7 +140,7 @@ if st.sidebar.button("🔄 Update Data"):
     with st.sidebar.status("Ingesting new files...", expanded=True) as status:
         try:
             ingest_files()
-            st.cache_data.clear()
+            clear_data_caches()
             status.update(label="Data updated!", state="complete", expanded=False)
             st.rerun()
         except Exception as e:
@@ -51,12 +150,11 @@ if st.sidebar.button("🔄 Update Data"):
 st.sidebar.markdown("---")
 
 try:
-    df = get_data()
+    viz = get_visualizer()
+    df = viz.data
     if df.empty:
         st.warning("No data found in database. Please run ingestion first.")
         st.stop()
-        
-    viz = Visualizer(df)
     
 except Exception as e:
     st.error(f"Error loading data: {e}")
@@ -65,11 +163,11 @@ except Exception as e:
 # --- Sidebar ---
 
 # Year Filter
-years = sorted(df['year'].unique().tolist(), reverse=True)
+years = df.attrs['years']
 selected_year = st.sidebar.selectbox("Select Year", years, index=0)
 
 # Device Filter
-available_devices = ["All"] + sorted(df['device_name'].unique().tolist())
+available_devices = ["All"] + df.attrs['devices']
 selected_device = st.sidebar.selectbox("Device", available_devices, index=0)
 
 # --- Category Manager in Sidebar ---
@@ -87,8 +185,9 @@ with st.sidebar.expander("📂 Manage Categories"):
     default_cat_index = 0
     default_alias_val = ""
 
+    uncategorized, all_cats = fetch_category_state()
+
     if mode == "Categorize New":
-        uncategorized = get_uncategorized_apps()
         if uncategorized:
             st.write(f"**{len(uncategorized)}** apps to categorize.")
             app_to_edit = st.selectbox("Select App", uncategorized)
@@ -97,7 +196,6 @@ with st.sidebar.expander("📂 Manage Categories"):
             st.success("🎉 All apps categorized!")
             
     else: # Edit Existing
-        all_cats = get_all_categories()
         if all_cats:
             sorted_apps = sorted(all_cats.keys())
             app_to_edit = st.selectbox("Select App to Edit", sorted_apps)
@@ -123,12 +221,12 @@ with st.sidebar.expander("📂 Manage Categories"):
             alias_val = new_alias if new_alias and new_alias != app_to_edit else None
             update_app_category(app_to_edit, new_category, alias_val)
             st.success(f"Saved: {app_to_edit} -> {new_category}")
-            st.cache_data.clear() # Reload data
+            clear_category_caches()
             st.rerun()
 
     st.markdown("---")
     if st.checkbox("Show All Mappings"):
-        st.json(get_all_categories(), expanded=False)
+        st.json(all_cats, expanded=False)
 
 # --- Main Dashboard ---
 st.title("📱 Screen Time Dashboard")
@@ -141,18 +239,7 @@ if selected_device != "All":
 st.markdown(f"Displaying data for: {filter_summary}")
 
 # KPI Row
-filtered_df = df[df['year'] == selected_year]
-if selected_device != "All":
-    filtered_df = filtered_df[filtered_df['device_name'] == selected_device]
-
-total_hours = filtered_df['duration_seconds'].sum() / 3600
-if not filtered_df.empty:
-    days_span = (filtered_df['date'].max() - filtered_df['date'].min()).days + 1
-    daily_avg_hours = (filtered_df['duration_seconds'].sum() / 3600) / max(days_span, 1)
-else:
-    daily_avg_hours = 0
-
-top_app = filtered_df.groupby('app_name')['duration_seconds'].sum().idxmax() if not filtered_df.empty else "N/A"
+total_hours, daily_avg_hours, top_app = compute_kpis(selected_year, selected_device)
 
 col1, col2, col3 = st.columns(3)
 col1.metric("Total Hours", f"{total_hours:.1f}h")
@@ -165,7 +252,7 @@ st.markdown("---")
 
 st.subheader("Hourly Activity Patterns")
 hourly_breakdown = st.radio("View by:", ["Device", "Category"], horizontal=True, key="hourly_breakdown")
-fig_hourly = viz.plot_hourly_activity(year=selected_year, device=selected_device, breakdown=hourly_breakdown)
+fig_hourly = get_hourly_chart(selected_year, selected_device, hourly_breakdown)
 if fig_hourly:
     st.plotly_chart(fig_hourly, use_container_width=True)
 else:
@@ -173,14 +260,14 @@ else:
 
 st.subheader("Weekly Screen Time Activity")
 weekly_breakdown = st.radio("View by:", ["Device", "Category"], horizontal=True, key="weekly_breakdown")
-fig_weekly = viz.plot_weekly_activity(year=selected_year, device=selected_device, breakdown=weekly_breakdown)
+fig_weekly = get_weekly_chart(selected_year, selected_device, weekly_breakdown)
 if fig_weekly:
     st.plotly_chart(fig_weekly, use_container_width=True)
 else:
     st.info("No data available for this selection.")
 
 st.subheader("Daily Activity Calendar")
-fig_calendar = viz.plot_daily_calendar(year=selected_year, device=selected_device)
+fig_calendar = get_calendar_chart(selected_year, selected_device)
 if fig_calendar:
     st.plotly_chart(fig_calendar, use_container_width=True)
 else:
@@ -188,7 +275,7 @@ else:
 
 st.subheader("Usage Trends")
 st.markdown("Long-term usage trend with 30-day moving average.")
-fig_trend = viz.plot_usage_trend(year=selected_year, device=selected_device, window=30)
+fig_trend = get_trend_chart(selected_year, selected_device)
 if fig_trend:
     st.plotly_chart(fig_trend, use_container_width=True)
 else:
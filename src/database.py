@@ -1,15 +1,91 @@
 import sqlite3
 import os
+import logging
+import threading
 from datetime import datetime
 
 # Resolve data directory relative to this file (in src/)
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(PROJECT_ROOT, "data", "db", "screentime.db")
 
+logger = logging.getLogger(__name__)
+
+# One cached connection per thread (see get_connection)
+_local = threading.local()
+
+# Set once ensure_indexes has succeeded in this process
+_indexes_ready = False
+
 def get_connection():
-    print(f"DEBUG: Connecting to DB at: {DB_PATH}")
+    """
+    Returns the cached connection of the calling thread, opening it on first use.
+    Callers must not close it. The cache saves the open and PRAGMA setup for
+    repeated calls within a thread (e.g. one ingestion or one script run);
+    Streamlit runs each rerun in a new thread, so there it still connects
+    about once per rerun.
+
+    The connection is in autocommit mode (isolation_level=None): callers that
+    write several rows must wrap them in "with conn:" plus an explicit BEGIN,
+    so a failure rolls back instead of leaving the transaction open.
+    WAL with synchronous=NORMAL avoids an fsync on every commit.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        # May be inside a caller's open transaction (a helper called within
+        # "with conn:"), which belongs to that caller and is left untouched
+        return conn
+
+    logger.debug("Connecting to DB at: %s", DB_PATH)
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    _local.conn = conn
+    if not _indexes_ready:
+        ensure_indexes(conn)
+    return conn
+
+def ensure_indexes(conn):
+    """
+    Creates the query indexes if missing. Runs from get_connection (once per
+    process) so databases created before an index was added get it without
+    re-running init_db. Before init_db has created the tables, or while another
+    writer holds the lock, it gives up quietly and retries on the next connection.
+    """
+    global _indexes_ready
+    try:
+        # Covering index for the per-app totals of get_uncategorized_apps
+        # (app_categories.app_name is already indexed by its UNIQUE constraint)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usage_app
+        ON usage_intervals (app_name, duration_seconds);
+        """)
+
+        # Per-device interval lookups: year/device filters of the weekly aggregates
+        # (start_time) and the incremental processing bounds (MAX/DELETE on end_time)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usage_device_start
+        ON usage_intervals (device_id, start_time);
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usage_device_end
+        ON usage_intervals (device_id, end_time);
+        """)
+
+        # Entries of a snapshot: the join in process_device_snapshots and ON DELETE CASCADE.
+        # raw_snapshots (device_id, timestamp) is already indexed by its UNIQUE constraint,
+        # and that index also covers id (the rowid).
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_entries_snapshot
+        ON raw_snapshot_entries (snapshot_id);
+        """)
+    except sqlite3.OperationalError as e:
+        logger.debug("Indexes not created yet: %s", e)
+        return
+    _indexes_ready = True
 
 def init_db():
     conn = get_connection()
@@ -80,12 +156,17 @@ def init_db():
         # Column likely already exists
         pass
 
-    conn.commit()
-    conn.close()
+    ensure_indexes(conn)
+
     print(f"Database initialized at {DB_PATH}")
 
-def get_or_create_device(device_name):
-    conn = get_connection()
+def get_or_create_device(device_name, conn=None):
+    """
+    Returns the id of the device, creating it if needed.
+    If a connection is passed, it is reused and the caller owns the transaction.
+    """
+    if conn is None:
+        conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM devices WHERE name = ?", (device_name,))
     row = cursor.fetchone()
@@ -94,8 +175,6 @@ def get_or_create_device(device_name):
     else:
         cursor.execute("INSERT INTO devices (name) VALUES (?)", (device_name,))
         device_id = cursor.lastrowid
-        conn.commit()
-    conn.close()
     return device_id
 
 # --- Category Management Helpers ---
@@ -106,7 +185,6 @@ def get_all_categories():
     cursor = conn.cursor()
     cursor.execute("SELECT app_name, category, alias FROM app_categories")
     rows = cursor.fetchall()
-    conn.close()
     return {row[0]: {'category': row[1], 'alias': row[2]} for row in rows}
 
 def update_app_category(app_name, category, alias=None):
@@ -120,8 +198,6 @@ def update_app_category(app_name, category, alias=None):
             category=excluded.category,
             alias=excluded.alias
     """, (app_name, category, alias))
-    conn.commit()
-    conn.close()
 
 def get_uncategorized_apps():
     """
@@ -141,8 +217,15 @@ def get_uncategorized_apps():
     """
     cursor.execute(query)
     rows = cursor.fetchall()
-    conn.close()
     return [row[0] for row in rows]
 
+def get_category_state():
+    """
+    Returns (uncategorized_apps, all_categories) as produced by
+    get_uncategorized_apps and get_all_categories, read in one go so the
+    category manager needs a single call per rerun.
+    """
+    return get_uncategorized_apps(), get_all_categories()
+
 if __name__ == "__main__":
     init_db()
@@ -1,6 +1,30 @@
 import re
 from datetime import datetime
 
+# Precompiled patterns used on every line / entry of a file
+_RE_HOURS = re.compile(r'(\d+)\s*h')
+_RE_MINUTES = re.compile(r'(\d+)\s*(?:m|min)')
+_RE_SECONDS = re.compile(r'(\d+)\s*(?:s|sec)')
+
+# One snapshot entry: the first two non-empty lines after the start of the
+# body or a comma, i.e. the title line and the seconds line
+_RE_ENTRY = re.compile(r'(?:^|,)\s*([^,\s][^,\n]*)\n\s*([^,\s][^,\n]*)')
+
+# Header formats, e.g. "13 Feb 2026 at 2:00 PM", "13 February 2026 at 14:00"
+# and ISO "2026-02-13 14:00:00"
+_RE_HEADER = re.compile(
+    r'^(\d{1,2})\s+([a-z]{3,})\s+(\d{4})\s+at\s+(\d{1,2}):(\d{1,2})(?:\s*(am|pm))?$',
+    re.IGNORECASE
+)
+_RE_HEADER_ISO = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})\s+(\d{1,2}):(\d{1,2}):(\d{1,2})$')
+
+_MONTH_NAMES = (
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+)
+_MONTHS = {name: i for i, name in enumerate(_MONTH_NAMES, start=1)}
+_MONTHS.update({name[:3]: i for i, name in enumerate(_MONTH_NAMES, start=1)})
+
 def parse_duration(duration_str):
     """
     Parses duration strings like "1h 30m", "45 min", "2h", "15m" into seconds.
@@ -9,17 +33,17 @@ def parse_duration(duration_str):
     duration_str = duration_str.lower().strip()
     
     # Check for hours
-    hours_match = re.search(r'(\d+)\s*h', duration_str)
+    hours_match = _RE_HOURS.search(duration_str)
     if hours_match:
         total_seconds += int(hours_match.group(1)) * 3600
         
     # Check for minutes (m, min)
-    minutes_match = re.search(r'(\d+)\s*(?:m|min)', duration_str)
+    minutes_match = _RE_MINUTES.search(duration_str)
     if minutes_match:
         total_seconds += int(minutes_match.group(1)) * 60
         
     # Check for seconds (s, sec) - less likely but possible
-    seconds_match = re.search(r'(\d+)\s*(?:s|sec)', duration_str)
+    seconds_match = _RE_SECONDS.search(duration_str)
     if seconds_match:
         total_seconds += int(seconds_match.group(1))
 
@@ -34,121 +58,119 @@ def parse_header_date(header_line):
     # narrow no-break space \u202f is common in iOS time formats
     clean_line = header_line.replace('\u202f', ' ').encode('ascii', 'ignore').decode('utf-8').strip()
     
-    # Try multiple formats
-    formats = [
-        "%d %b %Y at %I:%M %p", # 13 Feb 2026 at 2:00 PM
-        "%d %B %Y at %H:%M",    # 13 February 2026 at 14:00
-        "%Y-%m-%d %H:%M:%S",    # ISO
-    ]
-    
-    for fmt in formats:
+    # Match the known formats with a single regex and build the datetime
+    # directly, which is much cheaper than a chain of strptime attempts
+    match = _RE_HEADER.match(clean_line)
+    if match:
+        day, month_name, year, hour, minute, meridiem = match.groups()
+        month = _MONTHS.get(month_name.lower())
+        if month is None:
+            return None
+        hour = int(hour)
+        if meridiem:
+            # 12-hour clock: 12 AM is midnight, 12 PM is noon
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem.lower() == 'pm' else 0)
         try:
-            return datetime.strptime(clean_line, fmt)
+            return datetime(int(year), month, int(day), hour, int(minute))
         except ValueError:
-            continue
-            
-    # If standard formats fail, try with regex removal regarding "at" or similar
-    try:
-        if " at " in clean_line:
-            return datetime.strptime(clean_line, "%d %b %Y at %I:%M %p")
-    except ValueError:
-        pass
-        
+            return None
+
+    match = _RE_HEADER_ISO.match(clean_line)
+    if match:
+        try:
+            return datetime(*(int(part) for part in match.groups()))
+        except ValueError:
+            return None
+
     # print(f"Warning: Could not parse date header: '{header_line}' (cleaned: '{clean_line}')")
     return None
 
 def parse_chunk(chunk_lines):
     """
     Parses a single block of lines associated with a timestamp.
+    Entries are comma separated, each one made of a title line
+    ("App Name (bundle.id)") followed by a seconds line ("123 sec").
     Returns: dict({app_name: duration_seconds})
     """
     data = {}
     
-    # Rejoin lines to use the comma splitting logic
+    # Scan the whole body with a single regex instead of splitting it and
+    # matching every entry separately
     body = "\n".join(chunk_lines)
-    chunks = body.split(',')
     
-    for chunk in chunks:
-        chunk = chunk.strip()
-        if not chunk:
+    for title_line, seconds_line in _RE_ENTRY.findall(body):
+        # Extract App Name (drop the trailing "(...)" part)
+        title_line = title_line.strip()
+        head, paren, _ = title_line.rpartition('(')
+        if paren and title_line.endswith(')'):
+            app_name = head.strip()
+        else:
+            app_name = title_line
+        
+        # Extract Seconds
+        sec_str = seconds_line.lower().replace('sec', '').strip()
+        sec_str_clean = sec_str.replace(' ', '').replace('\u202f', '')
+        
+        try:
+            seconds = float(sec_str_clean)
+            data[app_name] = int(seconds)
+        except ValueError:
+            # print(f"Warning: Could not parse seconds from '{seconds_line}'")
             continue
-            
-        chunk_lines_inner = [l.strip() for l in chunk.splitlines() if l.strip()]
-        if len(chunk_lines_inner) >= 2:
-            title_line = chunk_lines_inner[0]
-            seconds_line = chunk_lines_inner[1]
-            
-            # Extract App Name
-            app_match = re.search(r'^(.*)\s*\(.*\)$', title_line)
-            if app_match:
-                app_name = app_match.group(1).strip()
-            else:
-                app_name = title_line.strip()
-            
-            # Extract Seconds
-            sec_str = seconds_line.lower().replace('sec', '').strip()
-            sec_str_clean = sec_str.replace(' ', '').replace('\u202f', '')
-            
-            try:
-                seconds = float(sec_str_clean)
-                data[app_name] = int(seconds)
-            except ValueError:
-                # print(f"Warning: Could not parse seconds from '{seconds_line}'")
-                continue
     return data
 
-def parse_file(filepath):
+def iter_file(filepath):
     """
-    Parses a shortcut output file that may contain multiple snapshots.
-    Returns:
-        list of tuples: [(timestamp, dict({app_name: duration_seconds})), ...]
+    Streams a shortcut output file that may contain multiple snapshots.
+    The file is read line by line and only the lines of the current snapshot
+    are kept in memory.
+    Yields:
+        tuples: (timestamp, dict({app_name: duration_seconds}))
     """
+    current_ts = None
+    current_lines = []
+
     with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read().strip()
+        # Scan lines to find dates
+        for raw_line in f:
+            line = raw_line.strip()
+            if not line:
+                continue
 
-    if not content:
-        return []
+            # Try to parse line as date
+            ts = parse_header_date(line)
 
-    lines = [l.strip() for l in content.splitlines() if l.strip()]
-    if not lines:
-        return []
+            if ts:
+                # We found a new date header.
+                # If we were accumulating lines for a previous snapshot, emit it now.
+                if current_ts:
+                    data = parse_chunk(current_lines)
+                    if data:
+                        yield current_ts, data
 
-    snapshots = []
-    
-    current_ts = None
-    current_lines = []
-    
-    # Scan lines to find dates
-    for line in lines:
-        # Try to parse line as date
-        ts = parse_header_date(line)
-        
-        if ts:
-            # We found a new date header.
-            # If we were accumulating lines for a previous snapshot, process it now.
-            if current_ts:
-                data = parse_chunk(current_lines)
-                if data:
-                    snapshots.append((current_ts, data))
-            
-            # Start new snapshot
-            current_ts = ts
-            current_lines = []
-        else:
-            # Not a date header, append to current block (if we have a started block)
-            if current_ts:
+                # Start new snapshot
+                current_ts = ts
+                current_lines = []
+            elif current_ts:
+                # Not a date header, append to current block
                 current_lines.append(line)
-            else:
-                # Ignore lines before the first date (e.g. Markdown headers)
-                pass
-                
+            # Lines before the first date (e.g. Markdown headers) are ignored
+
     # Process the last block
     if current_ts:
         data = parse_chunk(current_lines)
         if data:
-            snapshots.append((current_ts, data))
+            yield current_ts, data
 
-    return snapshots
+def parse_file(filepath):
+    """
+    Parses a shortcut output file that may contain multiple snapshots.
+    Returns:
+        list of tuples: [(timestamp, dict({app_name: duration_seconds})), ...]
+    """
+    return list(iter_file(filepath))
 
 if __name__ == "__main__":
     import sys
@@ -1,7 +1,6 @@
 import os
 import shutil
-import glob
-from log_parser import parse_file
+from log_parser import iter_file
 from database import get_connection, get_or_create_device
 from processing import process_device_snapshots
 
@@ -9,6 +8,12 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
 
+LOG_EXTENSIONS = ('.txt', '.md')
+
+# Max timestamps per "IN (...)" lookup, below SQLite's host parameter limit
+# (999 on older builds)
+IN_CLAUSE_BATCH = 900
+
 def ingest_files():
     # Detect device folders and files in data/ 
     reserved = {'db', 'processed', 'input'}
@@ -26,128 +31,204 @@ def ingest_files():
         print(f"Data directory {DATA_DIR} does not exist.")
         return
 
-    for item in os.listdir(DATA_DIR):
-        item_path = os.path.join(DATA_DIR, item)
-        
-        # Skip reserved or hidden
-        if item in reserved or item.startswith('.'):
-            continue
-            
-        if os.path.isdir(item_path):
-            # It's a device folder (e.g. "Activity iPhone 13 mini")
-            device_name = item.replace("Activity ", "").strip()
-            files = glob.glob(os.path.join(item_path, "*.txt")) + glob.glob(os.path.join(item_path, "*.md"))
-            
-            if files:
-                if device_name not in device_files_map:
-                    device_files_map[device_name] = []
-                device_files_map[device_name].extend(files)
-            
-            folders_to_cleanup.append(item_path)
-            
-        elif os.path.isfile(item_path):
-            # It's a file directly in data/ (e.g. "Activity iPhone 13 mini.txt")
-            if item.lower().endswith('.txt') or item.lower().endswith('.md'):
-                filename_no_ext = os.path.splitext(item)[0]
-                # Infer device name from filename
-                if filename_no_ext.startswith("Activity "):
-                    device_name = filename_no_ext.replace("Activity ", "").strip()
-                else:
-                    device_name = filename_no_ext.strip()
-                
-                if device_name not in device_files_map:
-                    device_files_map[device_name] = []
-                device_files_map[device_name].append(item_path)
+    # scandir returns the entry type along with the name, so there is no
+    # extra stat per item and each device folder is listed only once
+    with os.scandir(DATA_DIR) as entries:
+        for entry in entries:
+            item = entry.name
+
+            # Skip reserved or hidden
+            if item in reserved or item.startswith('.'):
+                continue
+
+            if entry.is_dir():
+                # It's a device folder (e.g. "Activity iPhone 13 mini")
+                device_name = item.replace("Activity ", "").strip()
+                with os.scandir(entry.path) as folder_entries:
+                    files = [
+                        f.path for f in folder_entries
+                        if not f.name.startswith('.')
+                        and f.name.lower().endswith(LOG_EXTENSIONS)
+                        and f.is_file()
+                    ]
+
+                if files:
+                    if device_name not in device_files_map:
+                        device_files_map[device_name] = []
+                    device_files_map[device_name].extend(files)
+
+                folders_to_cleanup.append(entry.path)
+
+            elif entry.is_file():
+                # It's a file directly in data/ (e.g. "Activity iPhone 13 mini.txt")
+                if item.lower().endswith(LOG_EXTENSIONS):
+                    filename_no_ext = os.path.splitext(item)[0]
+                    # Infer device name from filename
+                    if filename_no_ext.startswith("Activity "):
+                        device_name = filename_no_ext.replace("Activity ", "").strip()
+                    else:
+                        device_name = filename_no_ext.strip()
+
+                    if device_name not in device_files_map:
+                        device_files_map[device_name] = []
+                    device_files_map[device_name].append(entry.path)
+
+    # Files are read and parsed before the write transaction, so the database is
+    # not locked during file I/O.
+    # device_name -> {timestamp (isoformat): (file_source, data_dict)}
+    parsed = {}
+    files_to_archive = []
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     for device_name, file_paths in device_files_map.items():
         print(f"Processing data for device: {device_name}")
-        
-        # Get or create device ID
-        device_id = get_or_create_device(device_name)
-        
-        device_updated = False
+
+        # Snapshots of this device across its files (the first file wins on duplicates)
+        device_snapshots = {}
 
         for filepath in file_paths:
             print(f"  Processing file: {filepath}")
-            
+
             try:
-                snapshots = parse_file(filepath)
-                if not snapshots:
+                # Snapshots of this file, merged into device_snapshots only once
+                # the whole file has been parsed successfully
+                file_pending = {}
+                snapshot_count = 0
+                file_source = os.path.basename(filepath)
+
+                for timestamp, data_dict in iter_file(filepath):
+                    snapshot_count += 1
+                    # Converted once; the string is what dedup and the inserts use
+                    ts_str = timestamp.isoformat()
+                    # Deduplicate against this run (the database is checked below)
+                    if ts_str in device_snapshots or ts_str in file_pending:
+                        continue
+                    file_pending[ts_str] = (file_source, data_dict)
+
+                if not snapshot_count:
                     print(f"    Skipping {filepath}: No valid snapshots found.")
                     continue
-                
-                print(f"    Found {len(snapshots)} snapshots.")
-                
-                file_has_new_data = False
-                
-                for timestamp, data_dict in snapshots:
-                    # Check if snapshot already exists (deduplication by timestamp)
-                    cursor.execute(
-                        "SELECT id FROM raw_snapshots WHERE device_id = ? AND timestamp = ?",
-                        (device_id, timestamp.isoformat())
-                    )
-                    if cursor.fetchone():
-                        continue
-                    
-                    # Insert Snapshot
-                    cursor.execute(
-                        "INSERT INTO raw_snapshots (device_id, timestamp, file_source) VALUES (?, ?, ?)",
-                        (device_id, timestamp.isoformat(), os.path.basename(filepath))
-                    )
-                    snapshot_id = cursor.lastrowid
-                    
-                    # Insert Entries
-                    entries = []
-                    for app, seconds in data_dict.items():
-                        entries.append((snapshot_id, app, seconds))
-                    
-                    cursor.executemany(
-                        "INSERT INTO raw_snapshot_entries (snapshot_id, app_name, cumulative_seconds) VALUES (?, ?, ?)",
-                        entries
-                    )
-                    file_has_new_data = True
-                
-                if file_has_new_data:
-                    conn.commit()
-                    device_updated = True
-            
-                # Move to processed (flat structure)
-                os.makedirs(PROCESSED_DIR, exist_ok=True)
-                dest_path = os.path.join(PROCESSED_DIR, os.path.basename(filepath))
-                
-                # Handle filename collision in processed
-                if os.path.exists(dest_path):
-                    base, ext = os.path.splitext(os.path.basename(filepath))
-                    counter = 1
-                    while os.path.exists(dest_path):
-                        dest_path = os.path.join(PROCESSED_DIR, f"{base}_{counter}{ext}")
-                        counter += 1
-                
-                shutil.move(filepath, dest_path)
-                
+
+                print(f"    Found {snapshot_count} snapshots.")
+
+                device_snapshots.update(file_pending)
+                files_to_archive.append(filepath)
+
             except Exception as e:
                 print(f"Error processing {filepath}: {e}")
-                
-        # Trigger reprocessing of intervals for this device if we ingested new data
-        if device_updated:
-            print(f"Recalculating intervals for {device_name}...")
-            process_device_snapshots(device_id)
+
+        parsed[device_name] = device_snapshots
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    # Everything is inserted in a single transaction with one commit at the
+    # end: snapshot rows and entry rows are bulk inserted per device. Only the
+    # dedup lookup and the inserts run while it holds the write lock.
+    updated_devices = []
+
+    with conn:
+        # IMMEDIATE: the dedup reads and the inserts share one write lock. A deferred
+        # BEGIN would fail with "database is locked" on its first write if another
+        # connection committed after the reads, and busy_timeout cannot retry that
+        cursor.execute("BEGIN IMMEDIATE")
+        for device_name, device_snapshots in parsed.items():
+            # Get or create device ID
+            device_id = get_or_create_device(device_name, conn)
+
+            # Timestamps already stored for this device, loaded once for deduplication
+            cursor.execute("SELECT timestamp FROM raw_snapshots WHERE device_id = ?", (device_id,))
+            existing = {row[0] for row in cursor.fetchall()}
+
+            # timestamp (isoformat) -> (file_source, data_dict) for new snapshots
+            pending = {
+                ts_str: snapshot for ts_str, snapshot in device_snapshots.items()
+                if ts_str not in existing
+            }
+
+            if not pending:
+                continue
+
+            # First pass: insert all new snapshots of this device
+            cursor.executemany(
+                "INSERT INTO raw_snapshots (device_id, timestamp, file_source) VALUES (?, ?, ?)",
+                [(device_id, ts_str, source) for ts_str, (source, _) in pending.items()]
+            )
+
+            # Map the new timestamps back to the generated snapshot ids
+            new_timestamps = list(pending)
+            snapshot_ids = {}
+            for i in range(0, len(new_timestamps), IN_CLAUSE_BATCH):
+                batch = new_timestamps[i:i + IN_CLAUSE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT id, timestamp FROM raw_snapshots WHERE device_id = ? AND timestamp IN ({placeholders})",
+                    (device_id, *batch)
+                )
+                snapshot_ids.update((ts_str, snap_id) for snap_id, ts_str in cursor.fetchall())
+
+            # Second pass: stream the entries of every new snapshot into one
+            # executemany, without building the full list of rows in memory
+            cursor.executemany(
+                "INSERT INTO raw_snapshot_entries (snapshot_id, app_name, cumulative_seconds) VALUES (?, ?, ?)",
+                (
+                    (snapshot_ids[ts_str], app, seconds)
+                    for ts_str, (_, data_dict) in pending.items()
+                    for app, seconds in data_dict.items()
+                )
+            )
+
+            # Earliest new snapshot: intervals are recomputed from just before it
+            updated_devices.append((device_id, device_name, min(pending)))
+
+    # Move to processed (flat structure), only once the data is committed
+    if files_to_archive:
+        os.makedirs(PROCESSED_DIR, exist_ok=True)
+        # Names already taken in processed/, listed once and updated as files
+        # are moved, so collisions are resolved without a stat per candidate.
+        # Compared casefolded: on a case-insensitive filesystem (the macOS
+        # default) "log.txt" would otherwise replace an archived "Log.txt"
+        processed_names = {name.casefold() for name in os.listdir(PROCESSED_DIR)}
+
+    for filepath in files_to_archive:
+        try:
+            dest_name = os.path.basename(filepath)
+
+            # Handle filename collision in processed
+            if dest_name.casefold() in processed_names:
+                base, ext = os.path.splitext(dest_name)
+                counter = 1
+                while dest_name.casefold() in processed_names:
+                    dest_name = f"{base}_{counter}{ext}"
+                    counter += 1
+
+            dest_path = os.path.join(PROCESSED_DIR, dest_name)
+            try:
+                # Plain rename when source and destination share a filesystem
+                os.replace(filepath, dest_path)
+            except OSError:
+                shutil.move(filepath, dest_path)
+            processed_names.add(dest_name.casefold())
+        except Exception as e:
+            print(f"Error archiving {filepath}: {e}")
+
+    # Trigger reprocessing of intervals for each device that got new data
+    for device_id, device_name, since in updated_devices:
+        print(f"Recalculating intervals for {device_name}...")
+        process_device_snapshots(device_id, since=since)
 
     # Cleanup empty folders
     for folder_path in folders_to_cleanup:
         try:
             if os.path.exists(folder_path):
-                remaining_files = [f for f in os.listdir(folder_path) if f != '.DS_Store']
-                if not remaining_files:
+                # Stops at the first remaining entry instead of listing the whole folder
+                with os.scandir(folder_path) as entries:
+                    has_remaining_files = any(entry.name != '.DS_Store' for entry in entries)
+                if not has_remaining_files:
                     print(f"Removing empty folder: {folder_path}")
                     shutil.rmtree(folder_path)
         except Exception as e:
             print(f"Error cleaning up folder {folder_path}: {e}")
 
-    conn.close()
     print("Ingestion complete.")
 
 if __name__ == "__main__":
@@ -1,125 +1,158 @@
 from datetime import datetime
+from itertools import repeat
 import sqlite3
+import numpy as np
+import pandas as pd
 from database import get_connection
 
-def process_device_snapshots(device_id):
+# Rows per executemany call when inserting intervals
+INSERT_BATCH = 10000
+
+def process_device_snapshots(device_id, since=None, force=False):
     """
-    Recalculates intervals for a given device based on raw snapshots.
-    Optimized to only process new snapshots if possible, but for robustness
-    we might re-evaluate the chain or find the last processed point.
+    Calculates intervals for a given device based on raw snapshots.
+    
+    Processing is incremental: only snapshots after the latest interval end_time
+    are diffed, with the snapshot at that point as the baseline.
+    1. Find the anchor: the latest snapshot already covered by usage_intervals
+       (and older than `since`, the earliest newly added snapshot, if given).
+    2. Fetch the snapshots from the anchor onward, ordered by timestamp.
+    3. Calculate diffs between consecutive snapshots (vectorized per app over the entries).
+    4. Insert the resulting intervals, replacing any that end after the anchor
+       (only possible when snapshots were added out of order).
     
-    For simplicity in this V1:
-    1. Fetch all raw snapshots for the device ordered by timestamp.
-    2. Iterate and calculate diffs.
-    3. Update usage_intervals (delete old for this device and re-insert? Or merge?)
-       -> Deleting and re-inserting is safer for consistency if we expect out-of-order inserts.
-       -> However, if data is large, this is inefficient.
-       -> Better: find the latest interval end_time, and start processing snapshots after that.
+    force=True (or a device with no intervals yet) deletes every interval of the
+    device and rebuilds the whole chain.
     """
     conn = get_connection()
     cursor = conn.cursor()
 
-    # Get all snapshots ordered by time
-    cursor.execute("""
-        SELECT id, timestamp FROM raw_snapshots 
-        WHERE device_id = ? ORDER BY timestamp ASC
-    """, (device_id,))
-    snapshots = cursor.fetchall()
-    
-    if not snapshots:
-        conn.close()
-        return
+    anchor = None
+    if not force:
+        cursor.execute("SELECT MAX(end_time) FROM usage_intervals WHERE device_id = ?", (device_id,))
+        last_end = cursor.fetchone()[0]
+        if last_end is not None:
+            query = "SELECT id, timestamp FROM raw_snapshots WHERE device_id = ? AND timestamp <= ?"
+            params = [device_id, last_end]
+            if since is not None:
+                # Snapshots inserted before last_end invalidate the intervals after them
+                query += " AND timestamp < ?"
+                params.append(since)
+            cursor.execute(query + " ORDER BY timestamp DESC LIMIT 1", params)
+            anchor = cursor.fetchone()
 
-    # Clear existing intervals for this device to ensure consistency (Full Rebuild Approach)
-    # In a production system with millions of rows, we'd do incremental updates.
-    cursor.execute("DELETE FROM usage_intervals WHERE device_id = ?", (device_id,))
-    
-    # Cache entries for each snapshot to avoid N+1 queries
-    # Structure: {snapshot_id: {app_name: cumulative_seconds}}
-    snapshot_data = {}
-    
-    # Fetch all entries for this device
-    cursor.execute("""
-        SELECT se.snapshot_id, se.app_name, se.cumulative_seconds
-        FROM raw_snapshot_entries se
-        JOIN raw_snapshots s ON se.snapshot_id = s.id
+    # Snapshots ordered by time, starting at the anchor (its own row only serves
+    # as baseline), joined with their entries in a single query. The LEFT JOIN
+    # keeps snapshots without entries (app_name NULL).
+    query = """
+        SELECT s.id AS snapshot_id, s.timestamp, se.app_name, se.cumulative_seconds
+        FROM raw_snapshots s
+        LEFT JOIN raw_snapshot_entries se ON se.snapshot_id = s.id
         WHERE s.device_id = ?
-    """, (device_id,))
-    
-    for row in cursor.fetchall():
-        snap_id, app, seconds = row
-        if snap_id not in snapshot_data:
-            snapshot_data[snap_id] = {}
-        snapshot_data[snap_id][app] = seconds
+    """
+    params = [device_id]
+    if anchor is not None:
+        query += " AND s.timestamp >= ?"
+        params.append(anchor[1])
+    rows = pd.read_sql_query(query + " ORDER BY s.timestamp, se.id", conn, params=params)
+
+    if rows.empty:
+        return
 
-    intervals_to_insert = []
+    snapshots = list(rows.drop_duplicates('snapshot_id')[['snapshot_id', 'timestamp']].itertuples(index=False, name=None))
+    entries = rows.dropna(subset=['app_name'])
 
     # Logic:
     # Interval = Snap[i] - Snap[i-1]
     # IF same day AND Snap[i] >= Snap[i-1]
     
-    # We iterate from index 1.
-    # What about the very first snapshot of the day?
-    # Ideally, we'd have a snapshot at 00:00:00 with 0 usage.
-    # If we don't, the first snapshot IS the usage from 00:00 to T_first.
-    # So we should treat "start of day" as implicit previous snapshot with 0 usage.
-
-    for i, (curr_id, curr_ts_str) in enumerate(snapshots):
-        # Skip the very first snapshot (no prior baseline) to avoid assuming usage started at 00:00
-        if i == 0:
-            continue
-
-        # Convert timestamp string back to datetime object
-        curr_ts = datetime.fromisoformat(curr_ts_str)
-        curr_apps = snapshot_data.get(curr_id, {})
-        
-        prev_ts = None
-        prev_apps = {}
-        
-        if i > 0:
-            prev_id, prev_ts_str = snapshots[i-1]
-            prev_ts = datetime.fromisoformat(prev_ts_str)
-            prev_apps = snapshot_data.get(prev_id, {})
-            
-        # Determine start time and previous usage baseline
-        if prev_ts and prev_ts.date() == curr_ts.date():
+    # The very first snapshot is skipped (no prior baseline) to avoid assuming usage started at 00:00;
+    # in incremental mode that first row is the anchor, already processed.
+    # For the first snapshot of any later day there is no baseline at 00:00:00 either,
+    # so "start of day" is treated as an implicit previous snapshot with 0 usage.
+
+    # Per-snapshot bounds, computed once per snapshot (not per entry)
+    timestamps = [datetime.fromisoformat(ts_str) for _, ts_str in snapshots]
+    end_times = [ts.isoformat() for ts in timestamps]
+    start_times = []
+    new_day = np.zeros(len(snapshots), dtype=bool)
+    for i, curr_ts in enumerate(timestamps):
+        if i > 0 and timestamps[i-1].date() == curr_ts.date():
             # Same day: Diff from previous snapshot
-            step_start = prev_ts
-            base_usage = prev_apps
+            start_times.append(end_times[i-1])
         else:
-            # Different day (New day): Diff from 0 (implicitly from midnight-ish, or just T=0)
-            # Implicit usage: The snapshot represents usage from 00:00?
-            # Or assume start time is midnight?
-            # Let's assume start time is midnight of that day for the first interval.
-            step_start = datetime.combine(curr_ts.date(), datetime.min.time())
-            base_usage = {} # 0 usage baseline
-            
-        # Calculate intervals for each app in current snapshot
-        for app, curr_seconds in curr_apps.items():
-            prev_seconds = base_usage.get(app, 0)
-            delta = curr_seconds - prev_seconds
-            
-            if delta > 0:
-                intervals_to_insert.append((
-                    device_id,
-                    step_start.isoformat(),
-                    curr_ts.isoformat(),
-                    app,
-                    delta
-                ))
-            elif delta < 0:
-                # Anomaly: usage decreased? 
-                # Could be a device reset, or manual deletion of history.
-                # Log warning? For now, we ignore negative deltas or treat as 0.
-                pass
-
-    if intervals_to_insert:
-        cursor.executemany("""
-            INSERT INTO usage_intervals 
-            (device_id, start_time, end_time, app_name, duration_seconds)
-            VALUES (?, ?, ?, ?, ?)
-        """, intervals_to_insert)
-
-    conn.commit()
-    conn.close()
-    print(f"Processed {len(intervals_to_insert)} intervals for device {device_id}")
+            # Different day (New day): Diff from 0, starting at midnight of that day
+            start_times.append(datetime.combine(curr_ts.date(), datetime.min.time()).isoformat())
+            new_day[i] = True
+
+    interval_count = 0
+
+    if not entries.empty:
+        # Long form, one row per (snapshot, app) present, already in time order:
+        # each entry is diffed against the same app in the previous snapshot, so
+        # memory stays proportional to the entries (no dense snapshots x apps matrix)
+        entries = entries.drop_duplicates(['snapshot_id', 'app_name'], keep='last')
+        positions = {snap_id: i for i, (snap_id, _) in enumerate(snapshots)}
+        snap_idx = entries['snapshot_id'].map(positions).to_numpy()
+        curr = entries['cumulative_seconds'].to_numpy(dtype=float)
+
+        # Previous occurrence of each app, and the snapshot it was in
+        by_app = entries.assign(snap_idx=snap_idx).groupby('app_name', sort=False)
+        prev_idx = by_app['snap_idx'].shift().to_numpy(dtype=float)
+        prev_val = by_app['cumulative_seconds'].shift().to_numpy(dtype=float)
+
+        # Baseline: the previous snapshot on the same day, 0 for the first one of a day
+        # (and for apps the previous snapshot does not contain)
+        same_day_prev = (prev_idx == snap_idx - 1) & ~new_day[snap_idx]
+        deltas = curr - np.where(same_day_prev, prev_val, 0)
+
+        # Only positive usage. Negative deltas (device reset, manual deletion of
+        # history) are ignored; the first snapshot is only the baseline.
+        valid = (deltas > 0) & (snap_idx > 0)
+        snap_idx = snap_idx[valid]
+        app_col = entries['app_name'].to_numpy()[valid]
+        deltas = deltas[valid]
+
+        # Rows ordered by snapshot, then app name
+        order = np.lexsort((app_col.astype(str), snap_idx))
+        snap_idx, app_col = snap_idx[order], app_col[order]
+
+        start_col = np.array(start_times, dtype=object)[snap_idx]
+        end_col = np.array(end_times, dtype=object)[snap_idx]
+        duration_col = deltas[order].astype(np.int64)
+        interval_count = len(snap_idx)
+
+    # The delete + insert runs as one explicit transaction (the connection is in
+    # autocommit mode); with conn commits it, or rolls it back if anything fails.
+    # IMMEDIATE takes the write lock up front (waiting on busy_timeout) rather
+    # than on the first write
+    with conn:
+        cursor.execute("BEGIN IMMEDIATE")
+
+        if anchor is None:
+            # Full rebuild
+            cursor.execute("DELETE FROM usage_intervals WHERE device_id = ?", (device_id,))
+        else:
+            # Intervals after the anchor are recomputed (normally there are none)
+            cursor.execute(
+                "DELETE FROM usage_intervals WHERE device_id = ? AND end_time > ?",
+                (device_id, anchor[1])
+            )
+
+        # Inserted in fixed-size batches: the row tuples are built per batch,
+        # so memory stays bounded however long the history is
+        for i in range(0, interval_count, INSERT_BATCH):
+            batch = slice(i, i + INSERT_BATCH)
+            cursor.executemany("""
+                INSERT INTO usage_intervals 
+                (device_id, start_time, end_time, app_name, duration_seconds)
+                VALUES (?, ?, ?, ?, ?)
+            """, zip(
+                repeat(device_id),
+                start_col[batch].tolist(),
+                end_col[batch].tolist(),
+                app_col[batch].tolist(),
+                duration_col[batch].tolist()
+            ))
+
+    print(f"Processed {interval_count} intervals for device {device_id}")
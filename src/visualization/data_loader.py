@@ -2,18 +2,41 @@ import pandas as pd
 import sqlite3
 import os
 import sys
+import functools
 
 # Add src to path to import database module
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from database import DB_PATH
+from database import DB_PATH, get_all_categories
 
-def load_usage_data():
+def _db_version():
+    """
+    Returns (mtime_ns, size) of the database file and of its WAL file.
+    Commits land in the WAL first, so both are needed to notice a write.
+    """
+    version = []
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+def load_raw_usage():
     """
-    Loads usage data from the SQLite database into a Pandas DataFrame.
+    Loads usage data from the SQLite database into a Pandas DataFrame,
+    without categories and aliases (see apply_categories).
+    The result is cached until the database changes on disk and is shared
+    between callers, so it must not be modified in place.
     """
     if not os.path.exists(DB_PATH):
         return pd.DataFrame()
 
+    return _load_raw_usage_cached(_db_version())
+
+# Only the current version is useful: an older entry is stale and just holds memory
+@functools.lru_cache(maxsize=1)
+def _load_raw_usage_cached(db_version):
     conn = sqlite3.connect(DB_PATH)
     
     query = """
@@ -22,12 +45,9 @@ def load_usage_data():
         u.end_time,
         u.app_name,
         u.duration_seconds,
-        d.name as device_name,
-        c.category,
-        c.alias
+        d.name as device_name
     FROM usage_intervals u
     JOIN devices d ON u.device_id = d.id
-    LEFT JOIN app_categories c ON u.app_name = c.app_name
     """
     
     df = pd.read_sql_query(query, conn)
@@ -36,21 +56,124 @@ def load_usage_data():
     if df.empty:
         return df
 
-    # Convert timestamps to datetime
-    df['start_time'] = pd.to_datetime(df['start_time'])
-    df['end_time'] = pd.to_datetime(df['end_time'])
+    # Convert timestamps to datetime (stored as datetime.isoformat() strings, so the
+    # ISO8601 fast path applies instead of per-call format inference)
+    df['start_time'] = pd.to_datetime(df['start_time'], format='ISO8601')
+    df['end_time'] = pd.to_datetime(df['end_time'], format='ISO8601')
     
     # Enrich data
-    df['date'] = df['start_time'].dt.date
+    # Day as a datetime at midnight (not datetime.date objects), so grouping and
+    # counting days runs on int64 values
+    df['date'] = df['start_time'].dt.normalize()
     df['year'] = df['start_time'].dt.year
     df['hour'] = df['start_time'].dt.hour
     df['week'] = df['start_time'].dt.to_period('W').dt.start_time
+
+    # Compact dtypes: small integers for the year and hour, category codes for the
+    # low-cardinality device/app names, and the smallest integer type for durations
+    df['year'] = df['year'].astype('int16')
+    df['hour'] = df['hour'].astype('int8')
+    df['device_name'] = df['device_name'].astype('category')
+    df['app_name'] = df['app_name'].astype('category')
+    df['duration_seconds'] = pd.to_numeric(df['duration_seconds'], downcast='integer')
+
+    # Filter options, computed once instead of on every dashboard rerun
+    df.attrs['years'] = sorted((int(y) for y in df['year'].unique()), reverse=True)
+    df.attrs['devices'] = sorted(df['device_name'].cat.categories.tolist())
     
+    return df
+
+def apply_categories(df, categories):
+    """
+    Returns a copy of the raw usage data with category and alias applied.
+    categories: {app_name: {'category': category, 'alias': alias}},
+    as returned by database.get_all_categories.
+    Kept separate from the SQL load so a category change does not require
+    reading the usage rows again.
+    """
+    df = df.copy()
+    category_map = {app: info['category'] for app, info in categories.items()}
+    alias_map = {app: info['alias'] for app, info in categories.items()}
+
+    # Map on plain strings: filling a categorical with values that are not
+    # among its categories is not supported by every pandas version
+    app_names = df['app_name'].astype(object)
+
     # Fill missing categories
-    df['category'] = df['category'].fillna('Uncategorized')
+    df['category'] = app_names.map(category_map).fillna('Uncategorized').astype('category')
+    df['alias'] = app_names.map(alias_map)
     
     # Apply Aliasing: specific alias > original app_name
     df['original_app_name'] = df['app_name'] # Keep original for reference
-    df['app_name'] = df['alias'].fillna(df['app_name'])
+    df['app_name'] = df['alias'].fillna(app_names).astype('category')
     
     return df
+
+def load_usage_data():
+    """
+    Loads usage data from the SQLite database into a Pandas DataFrame,
+    with categories and aliases applied.
+    """
+    df = load_raw_usage()
+    if df.empty:
+        return df
+    return apply_categories(df, get_all_categories())
+
+def aggregate_usage(df):
+    """
+    Pre-aggregates the usage data for the KPI row.
+    Returns:
+        agg: total duration_seconds per (year, device_name, app_name)
+        span: first and last date ('min', 'max') per (year, device_name)
+    """
+    # Only filtered and summed by compute_kpis, so the groups are left unsorted
+    agg = df.groupby(['year', 'device_name', 'app_name'], observed=True, sort=False)['duration_seconds'].sum().reset_index()
+    span = df.groupby(['year', 'device_name'], observed=True, sort=False)['date'].agg(['min', 'max']).reset_index()
+    return agg, span
+
+def load_weekly_aggregates(year=None, device=None, breakdown="Device"):
+    """
+    Weekly usage totals filtered and aggregated by SQLite, in the shape
+    Visualizer.plot_weekly_activity expects for its `aggregated` argument:
+    week (Monday), device_name or category, duration_seconds and date
+    (number of distinct days with usage).
+    """
+    if not os.path.exists(DB_PATH):
+        return pd.DataFrame()
+
+    if breakdown == "Device":
+        group_col, group_expr = 'device_name', 'd.name'
+    else:
+        group_col, group_expr = 'category', "COALESCE(c.category, 'Uncategorized')"
+
+    conditions = []
+    params = []
+    if year:
+        # Range on the ISO strings instead of strftime() so the filter stays sargable
+        conditions.append("u.start_time >= ? AND u.start_time < ?")
+        params += [f"{year:04d}-01-01", f"{year + 1:04d}-01-01"]
+    if device and device != "All":
+        conditions.append("d.name = ?")
+        params.append(device)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    query = f"""
+    SELECT 
+        date(u.start_time, 'weekday 0', '-6 days') as week,
+        {group_expr} as {group_col},
+        SUM(u.duration_seconds) as duration_seconds,
+        COUNT(DISTINCT date(u.start_time)) as date
+    FROM usage_intervals u
+    JOIN devices d ON u.device_id = d.id
+    LEFT JOIN app_categories c ON u.app_name = c.app_name
+    {where}
+    GROUP BY week, {group_col}
+    ORDER BY week, {group_col}
+    """
+
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    df['week'] = pd.to_datetime(df['week'])
+    return df
@@ -1,5 +1,7 @@
-import plotly.express as px
+import calendar
+import functools
 import pandas as pd
+import numpy as np
 
 class Visualizer:
     """
@@ -18,37 +20,71 @@ class Visualizer:
     
     PLOT_WIDTH = 1200
     PLOT_HEIGHT = 600
+    
+    # Daily calendar: axis units between the month blocks (7 days wide, 6 weeks high)
+    CALENDAR_COL_STRIDE = 8
+    CALENDAR_ROW_STRIDE = 9
 
     def __init__(self, data: pd.DataFrame):
         self.data = data
+        # (year, device) -> filtered rows, see _filter
+        self._filter_cache = {}
+
+    def _filter(self, year: int = None, device: str = None) -> pd.DataFrame:
+        """
+        Rows of self.data matching the year/device filters, selected with a single
+        boolean mask. Only the matching slice is materialized, self.data is never copied.
+        The slice is memoized per (year, device) and shared by every plot method
+        (and rerun), so callers must not modify it in place.
+        """
+        key = (year or None, device if device and device != "All" else None)
+        if key in self._filter_cache:
+            return self._filter_cache[key]
 
-    def plot_weekly_activity(self, year: int = None, device: str = None, breakdown: str = "Device"):
+        df = self.data
+        if key == (None, None):
+            filtered = df
+        else:
+            mask = np.ones(len(df), dtype=bool)
+            if key[0]:
+                mask &= df['year'].values == key[0]
+            if key[1]:
+                mask &= df['device_name'].values == key[1]
+            filtered = df[mask]
+
+        self._filter_cache[key] = filtered
+        return filtered
+
+    def plot_weekly_activity(self, year: int = None, device: str = None, breakdown: str = "Device",
+                             aggregated: pd.DataFrame = None):
         """
         Stacked Bar chart of average daily usage hours per week, split by Device or Category.
         Stats are aggregated by Week and Breakdown column.
+        aggregated: optional weekly totals already filtered and aggregated elsewhere
+        (see data_loader.load_weekly_aggregates); when given, self.data is not scanned.
         """
-        df = self.data.copy()
-        
-        # Filter by year
-        if year:
-            df = df[df['year'] == year]
-            
-        # Filter by device
-        if device and device != "All":
-            df = df[df['device_name'] == device]
-        
-        if df.empty:
-            return None
+        import plotly.colors
+        import plotly.graph_objects as go
 
         # Determine grouping column
         group_col = 'device_name' if breakdown == "Device" else 'category'
-        color_seq = self.DEVICE_COLORS if breakdown == "Device" else px.colors.qualitative.Vivid
+        color_seq = self.DEVICE_COLORS if breakdown == "Device" else plotly.colors.qualitative.Vivid
+
+        if aggregated is None:
+            df = self._filter(year, device)
+            
+            if df.empty:
+                return None
 
-        # Aggregate duration per week and breakdown column, counting unique days
-        aggregated = df.groupby(['week', group_col]).agg({
-            'duration_seconds': 'sum',
-            'date': 'nunique'
-        }).reset_index()
+            # Aggregate duration per week and breakdown column, counting unique days
+            aggregated = df.groupby(['week', group_col], observed=True).agg({
+                'duration_seconds': 'sum',
+                'date': 'nunique'
+            }).reset_index()
+        elif aggregated.empty:
+            return None
+        else:
+            aggregated = aggregated.copy()
         
         # Calculate Average Daily Hours for that week
         # Avoid division by zero by ensuring at least 1 day count (though nunique shouldn't be 0 if data exists)
@@ -56,21 +92,22 @@ class Visualizer:
         aggregated['avg_daily_hours'] = (aggregated['duration_seconds'] / 3600) / aggregated['days_count']
         
         # Format for tooltip
-        aggregated['formatted_time'] = aggregated.apply(
-            lambda x: f"{x['avg_daily_hours']:.1f}h/day ({int(x['duration_seconds'] // 3600)}h total)", 
-            axis=1
+        aggregated['formatted_time'] = (
+            aggregated['avg_daily_hours'].map('{:.1f}'.format) + "h/day ("
+            + (aggregated['duration_seconds'] // 3600).astype(int).astype(str) + "h total)"
         )
         
-        fig = px.bar(
-            aggregated, 
-            x='week', 
-            y='avg_daily_hours',
-            color=group_col,
-            title=None,
-            labels={'avg_daily_hours': 'Avg Daily Hours', 'week': 'Week', group_col: breakdown},
-            custom_data=['formatted_time', group_col],
-            color_discrete_sequence=color_seq
-        )
+        # One stacked bar trace per group, in order of first appearance, with the
+        # group as the trace name and only the tooltip text as customdata
+        fig = go.Figure()
+        for i, (name, group) in enumerate(aggregated.groupby(group_col, observed=True, sort=False)):
+            fig.add_trace(go.Bar(
+                x=group['week'],
+                y=group['avg_daily_hours'],
+                name=str(name),
+                customdata=group['formatted_time'].to_numpy(),
+                marker_color=color_seq[i % len(color_seq)]
+            ))
         
         # Styling
         fig.update_layout(
@@ -85,6 +122,8 @@ class Visualizer:
                 xanchor="right",
                 x=1
             ),
+            legend_title_text=breakdown,
+            barmode='stack',
             hovermode="x",
             width=self.PLOT_WIDTH,
             height=self.PLOT_HEIGHT,
@@ -103,27 +142,46 @@ class Visualizer:
         
         fig.update_traces(
             marker_line_width=0,
-            hovertemplate="<br><b>%{customdata[1]}</b><br><b>Usage</b>: %{customdata[0]}<extra></extra>",
+            hovertemplate="<br><b>%{fullData.name}</b><br><b>Usage</b>: %{customdata}<extra></extra>",
             hoverlabel=dict(bgcolor="black")
         )
         
         return fig
 
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def _calendar_layout(cls, year: int) -> pd.DataFrame:
+        """
+        Grid position and hover label of every day of the year in the daily calendar.
+        Depends only on the year, so it is cached and shared between calls
+        and must not be modified in place.
+        """
+        layout = pd.DataFrame({'date': pd.date_range(start=f"{year}-01-01", end=f"{year}-12-31")})
+        
+        # Coordinates
+        month_idx = layout['date'].dt.month - 1
+        day_of_week = layout['date'].dt.dayofweek
+        
+        # Weekly row calculation, offset by the weekday of each month's first day
+        day_idx = layout['date'].dt.day - 1
+        first_day_weekday = (day_of_week - day_idx) % 7
+        week_of_month = (day_idx + first_day_weekday) // 7
+        
+        # All months share one axis: each month is a 7x6 block, placed on the
+        # 3x4 grid with a one unit gap between columns and room for the title between rows
+        layout['x'] = (month_idx % 4) * cls.CALENDAR_COL_STRIDE + day_of_week
+        layout['y'] = (2 - month_idx // 4) * cls.CALENDAR_ROW_STRIDE + 5 - week_of_month
+        
+        layout['date_label'] = "<b>" + layout['date'].dt.strftime('%d %b') + "</b><br>"
+        return layout
+
     def plot_daily_calendar(self, year: int = None, device: str = None):
         """
         3x4 Month Grid Scatter plot showing daily usage intensity.
         """
-        import calendar
-        from plotly.subplots import make_subplots
         import plotly.graph_objects as go
         
-        df = self.data.copy()
-        
-        if year:
-            df = df[df['year'] == year]
-            
-        if device and device != "All":
-            df = df[df['device_name'] == device]
+        df = self._filter(year, device)
 
         if df.empty:
             return None
@@ -131,84 +189,79 @@ class Visualizer:
         # Aggregate daily usage
         daily = df.groupby('date')['duration_seconds'].sum().reset_index()
         daily['hours'] = daily['duration_seconds'] / 3600
-        daily['date'] = pd.to_datetime(daily['date'])
         
         # Max usage for color normalization
         max_usage = daily['hours'].max() if not daily.empty else 1
-        
-        # Prepare subplots
-        fig = make_subplots(
-            rows=3, cols=4, 
-            subplot_titles=[calendar.month_name[i] for i in range(1, 13)],
-            vertical_spacing=0.08,
-            horizontal_spacing=0.03
-        )
 
-        for month in range(1, 13):
-            row = (month - 1) // 4 + 1
-            col = (month - 1) % 4 + 1
-            
-            _, num_days = calendar.monthrange(year, month)
-            dates = pd.date_range(start=f"{year}-{month:02d}-01", end=f"{year}-{month:02d}-{num_days}")
-            
-            month_df = pd.DataFrame({'date': dates})
-            month_df = month_df.merge(daily[['date', 'hours']], on='date', how='left').fillna({'hours': 0})
-            
-            # Coordinates
-            month_df['day_of_week'] = month_df['date'].dt.dayofweek
-            
-            # Weekly row calculation
-            first_day_weekday = month_df.iloc[0]['date'].dayofweek
-            month_df['day_idx'] = month_df['date'].dt.day - 1
-            month_df['week_of_month'] = (month_df['day_idx'] + first_day_weekday) // 7
-            
-            month_df['hover_text'] = month_df.apply(
-                lambda x: f"<b>{x['date'].strftime('%d %b')}</b><br>{x['hours']:.1f}h" if x['hours'] > 0 else f"<b>{x['date'].strftime('%d %b')}</b><br>No Data",
-                axis=1
+        # Daily hours aligned on the cached layout of the year (one reindex on the
+        # dates instead of a join; days without usage get 0)
+        layout = self._calendar_layout(year)
+        hours = daily.set_index('date')['hours'].reindex(layout['date'], fill_value=0).to_numpy()
+        
+        # Active vs Inactive, split with one boolean mask over plain arrays
+        x = layout['x'].to_numpy()
+        y = layout['y'].to_numpy()
+        active = hours > 0
+        
+        # Hover text is only shown for active days (inactive markers skip hover)
+        active_hours = hours[active]
+        hover_text = (
+            layout['date_label'].to_numpy()[active]
+            + pd.Series(active_hours).map('{:.1f}'.format).to_numpy() + "h"
+        )
+        
+        fig = go.Figure()
+        
+        # Inactive Trace
+        fig.add_trace(
+            go.Scatter(
+                x=x[~active],
+                y=y[~active],
+                mode='markers',
+                marker=dict(size=10, color='#262730'),
+                hoverinfo='skip',
+                showlegend=False
             )
-            
-            # Active vs Inactive
-            active_df = month_df[month_df['hours'] > 0].copy()
-            inactive_df = month_df[month_df['hours'] == 0].copy()
-            
-            # Inactive Trace
+        )
+        
+        # Active Trace
+        if active.any():
             fig.add_trace(
                 go.Scatter(
-                    x=inactive_df['day_of_week'],
-                    y=5 - inactive_df['week_of_month'],
+                    x=x[active],
+                    y=y[active],
                     mode='markers',
-                    marker=dict(size=10, color='#262730'),
-                    hoverinfo='skip',
-                    showlegend=False
-                ),
-                row=row, col=col
-            )
-            
-            # Active Trace
-            if not active_df.empty:
-                fig.add_trace(
-                    go.Scatter(
-                        x=active_df['day_of_week'],
-                        y=5 - active_df['week_of_month'],
-                        mode='markers',
-                        marker=dict(
-                            size=10,
-                            color=active_df['hours'],
-                            colorscale='Viridis',
-                            cmin=0,
-                            cmax=max_usage,
-                            showscale=(month == 12),
-                            colorbar=dict(title="Hours", x=1.02, len=0.7) if month==12 else None
-                        ),
-                        text=active_df['hover_text'],
-                        hoverinfo='text',
-                        showlegend=False
+                    marker=dict(
+                        size=10,
+                        color=active_hours,
+                        colorscale='Viridis',
+                        cmin=0,
+                        cmax=max_usage,
+                        showscale=True,
+                        colorbar=dict(title="Hours", x=1.02, len=0.7)
                     ),
-                    row=row, col=col
+                    text=hover_text,
+                    hoverinfo='text',
+                    showlegend=False
                 )
-                
-            fig.update_xaxes(showgrid=False, zeroline=False, showticklabels=False, range=[-0.5, 6.5], row=row, col=col)
-            fig.update_yaxes(showgrid=False, zeroline=False, showticklabels=False, range=[-0.5, 6.5], row=row, col=col)
+            )
+        
+        # Month titles above each block
+        for month in range(1, 13):
+            fig.add_annotation(
+                x=((month - 1) % 4) * self.CALENDAR_COL_STRIDE + 3,
+                y=(2 - (month - 1) // 4) * self.CALENDAR_ROW_STRIDE + 6.5,
+                text=calendar.month_name[month],
+                showarrow=False,
+                xanchor='center',
+                yanchor='bottom',
+                font=dict(size=16)
+            )
+        
+        fig.update_xaxes(showgrid=False, zeroline=False, showticklabels=False,
+                         range=[-0.5, 3 * self.CALENDAR_COL_STRIDE + 6.5])
+        fig.update_yaxes(showgrid=False, zeroline=False, showticklabels=False,
+                         range=[-0.5, 2 * self.CALENDAR_ROW_STRIDE + 6.5])
 
         fig.update_layout(
             title=None,
@@ -227,13 +280,9 @@ class Visualizer:
         Bar chart showing average daily minutes per hour of the day (0-23).
         breakdown: "Device" or "Category"
         """
-        df = self.data.copy()
-        
-        if year:
-            df = df[df['year'] == year]
-            
-        if device and device != "All":
-            df = df[df['device_name'] == device]
+        import plotly.express as px
+
+        df = self._filter(year, device)
 
         if df.empty:
             return None
@@ -249,7 +298,7 @@ class Visualizer:
         days_count = max(days_count, 1)
 
         # Aggregate duration per hour and breakdown column
-        hourly = df.groupby(['hour', group_col])['duration_seconds'].sum().reset_index()
+        hourly = df.groupby(['hour', group_col], observed=True)['duration_seconds'].sum().reset_index()
         
         # Convert to Average Minutes per Day
         hourly['avg_minutes'] = (hourly['duration_seconds'] / 60) / days_count
@@ -303,13 +352,7 @@ class Visualizer:
         """
         Line chart showing daily usage trend with a rolling average.
         """
-        df = self.data.copy()
-        
-        if year:
-            df = df[df['year'] == year]
-            
-        if device and device != "All":
-            df = df[df['device_name'] == device]
+        df = self._filter(year, device)
 
         if df.empty:
             return None
@@ -317,7 +360,6 @@ class Visualizer:
         # Aggregate daily usage
         daily = df.groupby('date')['duration_seconds'].sum().reset_index()
         daily['hours'] = daily['duration_seconds'] / 3600
-        daily['date'] = pd.to_datetime(daily['date'])
         
         # Sort by date to ensure rolling calculation is correct
         daily = daily.sort_values('date')